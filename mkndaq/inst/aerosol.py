@@ -6,11 +6,12 @@ Define a class AEROSOL to handle aerosol data generated by PSI CATCOS.
 """
 
 import os
+import socket
 import time
 import logging
-import shutil
-import zipfile
-from mkndaq.utils.filesync import rsync
+import concurrent.futures
+import functools
+from mkndaq.utils.filesync import link_or_copy, rsync, zip_file, zip_files, zip_pool
 
 import colorama
 
@@ -26,15 +27,22 @@ class AEROSOL:
 
     _log = None
     _staging = None
+    _stage_dir = None
     _datadir = None
     _buckets = None
     _days_to_sync = None
     _name = None
     _logger = None
     _source = None
+    _host = None
     _netshare = None
+    _netshare_ok = False
+    _netshare_last_check = None
+    _netshare_ttl = 30
+    _compresslevel = 1
+    _zip_batch = False
+    _staged = None
 
-    @classmethod
     def __init__(self, name: str, config: dict) -> None:
         """
         Constructor
@@ -50,17 +58,8 @@ class AEROSOL:
         print("# Initialize AEROSOL")
 
         try:
-            # setup logging
-            logdir = os.path.expanduser(config['logs'])
-            os.makedirs(logdir, exist_ok=True)
-            logfile = '%s.log' % time.strftime('%Y%m%d')
-            logfile = os.path.join(logdir, logfile)
+            # logging is configured once by the application
             self._logger = logging.getLogger(__name__)
-            logging.basicConfig(level=logging.DEBUG,
-                                format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                                datefmt='%y-%m-%d %H:%M:%S',
-                                filename=str(logfile),
-                                filemode='a')
 
             # read instrument control properties for later use
             self._name = name
@@ -73,6 +72,7 @@ class AEROSOL:
 
             # source of data files
             dbs = r"\\"
+            self._host = config[name]['socket']['host']
             self._netshare = os.path.join(f"{dbs}{config[name]['socket']['host']}", config[name]['netshare'])
 
             # reporting/storage
@@ -89,11 +89,19 @@ class AEROSOL:
 
             # staging area for files to be transfered
             self._staging = os.path.expanduser(config['staging']['path'])
+            self._stage_dir = os.path.join(self._staging, self._name)
+            os.makedirs(self._stage_dir, exist_ok=True)
             self._zip = config[name]['staging_zip']
+            self._compresslevel = config[name].get('staging_compresslevel', 1)
+            self._zip_batch = config[name].get('staging_zip_batch', False)
+
+            # files staged so far, and when. Seeded with what is still waiting for transfer.
+            with os.scandir(self._stage_dir) as it:
+                self._staged = {entry.name: entry.stat().st_mtime for entry in it if entry.is_file()}
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
     # @classmethod
@@ -125,7 +133,6 @@ class AEROSOL:
     #         print(err)
 
 
-    @classmethod
     def store_and_stage_files(self):
         """
         Fetch data files from local source and move to datadir. Zip files and place in staging area.
@@ -134,27 +141,42 @@ class AEROSOL:
         :return: None
         """
         try:
-            if os.path.exists(self._netshare):
+            if self.netshare_accessible():
                 # copy 'new' files from source to target
                 files_received = rsync(source=self._netshare, 
                                         target=self._datadir, 
                                         buckets=self._buckets, 
                                         days=self._days_to_sync)
 
-                # stage data for transfer
-                for file in files_received:    
-                    stage = os.path.join(self._staging, self._name)
-                    os.makedirs(stage, exist_ok=True)
+                # skip files that have already been staged
+                files_received = [file for file in files_received
+                                  if self._staged_name(os.path.basename(file)) not in self._staged]
+                now = time.time()
+                self._staged.update((self._staged_name(os.path.basename(file)), now) for file in files_received)
+
+                # forget files that are too old to be synced again, to bound memory
+                oldest = now - self._days_to_sync * 86400
+                self._staged = {name: staged for name, staged in self._staged.items() if staged > oldest}
+
+                # stage data for transfer. Files are compressed/copied in the background, so that
+                # staging of this batch overlaps with the next call to rsync.
+                if self._zip and self._zip_batch and len(files_received) > 1:
+                    # create a single zip file for the whole batch
+                    archive = os.path.join(self._stage_dir, f"{self._name}-{time.strftime('%Y%m%d%H%M%S')}.zip")
+                    future = zip_pool.submit(zip_files, files_received, archive, None, self._compresslevel)
+                    future.add_done_callback(functools.partial(self._report_staged, os.path.basename(archive)))
+                    files_received = []
+
+                for file in files_received:
+                    name = os.path.basename(file)
 
                     if self._zip:
                         # create zip file
-                        archive = os.path.join(stage, "".join([os.path.basename(file)[:-4], ".zip"]))
-                        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as fh:
-                            fh.write(file, os.path.basename(file))
+                        archive = os.path.join(self._stage_dir, self._staged_name(name))
+                        future = zip_pool.submit(zip_file, file, archive, name, self._compresslevel)
                     else:
-                        shutil.copyfile(os.path.join(self._datadir, file), os.path.join(stage, os.path.basename(file)))
-
-                    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} .store_and_stage_new_files (name={self._name}, file={os.path.basename(file)})")
+                        future = zip_pool.submit(link_or_copy, file, os.path.join(self._stage_dir, name))
+                    future.add_done_callback(functools.partial(self._report_staged, name))
             else:
                 msg = f"{time.strftime('%Y-%m-%d %H:%M:%S')} (name={self._name}) Warning: {self._netshare} is not accessible!)"
                 if self._log:
@@ -165,9 +187,57 @@ class AEROSOL:
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
+    def _staged_name(self, name: str) -> str:
+        """
+        Name of a data file once it is staged.
+
+        :param name: name of data file
+        :return: name of the staged file
+        """
+        if self._zip:
+            return "".join([name[:-4], ".zip"])
+        return name
+
+    def netshare_accessible(self) -> bool:
+        """
+        Check if the netshare is accessible. The result is cached for a short while, since probing a
+        network share is expensive and may block for a long time if the remote host is down.
+        The SMB port of the host is probed first with a short timeout, so that an unreachable host
+        fails fast instead of waiting for the SMB session timeout.
+
+        :return: True if netshare is accessible
+        """
+        now = time.monotonic()
+        if self._netshare_last_check is None or now - self._netshare_last_check > self._netshare_ttl:
+            try:
+                with socket.create_connection((self._host, 445), timeout=2.0):
+                    reachable = True
+            except OSError:
+                reachable = False
+            self._netshare_ok = reachable and os.path.exists(self._netshare)
+            self._netshare_last_check = now
+        return self._netshare_ok
+
+    def _report_staged(self, name: str, future: concurrent.futures.Future) -> None:
+        """
+        Report the outcome of staging a file in the background.
+
+        :param name: name of file staged
+        :param future: future of the staging task
+        :return: None
+        """
+        err = future.exception()
+        if err:
+            msg = f"{time.strftime('%Y-%m-%d %H:%M:%S')} (name={self._name}) Warning: {name} could not be staged ({err})"
+            if self._log:
+                self._logger.error(msg)
+            print(colorama.Fore.RED + msg)
+        else:
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} .store_and_stage_new_files (name={self._name}, file={name})")
+
     # try:
     #     print("%s .store_and_stage_files (name=%s)" % (time.strftime('%Y-%m-%d %H:%M:%S'), self._name))
 
@@ -190,7 +260,6 @@ class AEROSOL:
     #     print(err)
 
 
-    @classmethod
     def print_aerosol(self) -> None:
         try:
             # files = os.listdir(self._source)
@@ -203,5 +272,5 @@ class AEROSOL:
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
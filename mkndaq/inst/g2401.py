@@ -9,9 +9,7 @@ import os
 import socket
 import time
 import logging
-import shutil
-from mkndaq.utils.filesync import rsync
-import zipfile
+from mkndaq.utils.filesync import link_or_copy, rsync, zip_file
 
 import colorama
 
@@ -170,17 +168,16 @@ class G2401:
                                         days=self._days_to_sync)
                 
                 # stage data for transfer
-                for file in files_received:
-                    stage = os.path.join(self._staging, self._name)
+                stage = os.path.join(self._staging, self._name)
+                if files_received:
                     os.makedirs(stage, exist_ok=True)
-
+                for file in files_received:
                     if self._zip:
                         # create zip file
                         archive = os.path.join(stage, "".join([os.path.basename(file)[:-4], ".zip"]))
-                        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as fh:
-                            fh.write(file, os.path.basename(file))
+                        zip_file(file, archive)
                     else:
-                        shutil.copyfile(os.path.join(self._datadir, file), os.path.join(stage, os.path.basename(file)))
+                        link_or_copy(os.path.join(self._datadir, file), os.path.join(stage, os.path.basename(file)))
 
                     print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} .store_and_stage_files (name={self._name}, file={os.path.basename(file)})")
 
@@ -8,11 +8,12 @@ Define a class METEO to handle meteo data generated by MeteoSwiss.
 import os
 import time
 import logging
-import shutil
-import zipfile
+import concurrent.futures
 
 import colorama
 
+from mkndaq.utils.filesync import link_or_copy, move_file, zip_file, zip_files, zip_pool
+
 
 class METEO:
     """
@@ -24,13 +25,15 @@ class METEO:
 
     _log = None
     _zip = None
+    _compresslevel = 1
+    _zip_batch = False
     _staging = None
+    _stage_dir = None
     _datadir = None
     _name = None
     _logger = None
     _source = None
 
-    @classmethod
     def __init__(self, name: str, config: dict) -> None:
         """
         Constructor
@@ -46,17 +49,8 @@ class METEO:
         print("# Initialize METEO")
 
         try:
-            # setup logging
-            logdir = os.path.expanduser(config['logs'])
-            os.makedirs(logdir, exist_ok=True)
-            logfile = '%s.log' % time.strftime('%Y%m%d')
-            logfile = os.path.join(logdir, logfile)
+            # logging is configured once by the application
             self._logger = logging.getLogger(__name__)
-            logging.basicConfig(level=logging.DEBUG,
-                                format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                                datefmt='%y-%m-%d %H:%M:%S',
-                                filename=str(logfile),
-                                filemode='a')
 
             # read instrument control properties for later use
             self._name = name
@@ -76,14 +70,17 @@ class METEO:
             # staging area for files to be transfered
             self._staging = os.path.expanduser(config['staging']['path'])
             os.makedirs(self._staging, exist_ok=True)
+            self._stage_dir = os.path.join(self._staging, self._name)
+            os.makedirs(self._stage_dir, exist_ok=True)
             self._zip = config[name]['staging_zip']
+            self._compresslevel = config[name].get('staging_compresslevel', 1)
+            self._zip_batch = config[name].get('staging_zip_batch', False)
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
-    @classmethod
     def store_and_stage_files(self):
         """
         Fetch data files from local source and move to datadir. Zip files and place in staging area.
@@ -93,43 +90,55 @@ class METEO:
         try:
             print("%s .store_and_stage_files (name=%s)" % (time.strftime('%Y-%m-%d %H:%M:%S'), self._name))
 
-            # get data file from local source
-            files = os.listdir(self._source)
-
-            if files:
-                # staging location for transfer
-                stage = os.path.join(self._staging, self._name)
-                os.makedirs(stage, exist_ok=True)
-
-                # store and stage data files
-                for file in files:
-                    # stage file
+            # get data files from local source
+            with os.scandir(self._source) as it:
+                entries = [entry for entry in it if entry.is_file()]
+
+            if entries:
+                # data storage location, same for all files of this batch
+                yyyy, mm, dd = time.strftime("%Y %m %d").split()
+                target = os.path.join(self._datadir, yyyy, mm, dd)
+                os.makedirs(target, exist_ok=True)
+
+                # stage data files, compressing them in parallel
+                futures = []
+                if self._zip and self._zip_batch and len(entries) > 1:
+                    # create a single zip file for the whole batch
+                    archive = os.path.join(self._stage_dir, f"{self._name}-{time.strftime('%Y%m%d%H%M%S')}.zip")
+                    future = zip_pool.submit(zip_files, [entry.path for entry in entries], archive,
+                                             [entry.name for entry in entries], self._compresslevel)
+                    futures = [future] * len(entries)
+                for entry in entries[len(futures):]:
                     if self._zip:
                         # create zip file
-                        archive = os.path.join(stage, "".join([file[:-4], ".zip"]))
-                        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as fh:
-                            fh.write(os.path.join(self._source, file), file)
+                        archive = os.path.join(self._stage_dir, "".join([entry.name[:-4], ".zip"]))
+                        futures.append(zip_pool.submit(zip_file, entry.path, archive, entry.name, self._compresslevel))
                     else:
-                        shutil.copyfile(os.path.join(self._source, file), os.path.join(stage, file))
-
-                    # move to data storage location
-                    # shutil.move(os.path.join(self._source, file), os.path.join(self._datadir, file))
-                    target = os.path.join(self._datadir, time.strftime("%Y"), time.strftime("%m"), time.strftime("%d"))
-                    os.makedirs(target, exist_ok=True)
-                    shutil.move(os.path.join(self._source, file), os.path.join(target, file))
+                        link_or_copy(entry.path, os.path.join(self._stage_dir, entry.name))
+                        futures.append(None)
+                concurrent.futures.wait([future for future in futures if future is not None])
+
+                # move to data storage location, unless staging failed
+                for entry, future in zip(entries, futures):
+                    if future is not None and future.exception() is not None:
+                        msg = f"{time.strftime('%Y-%m-%d %H:%M:%S')} (name={self._name}) Warning: {entry.name} could not be staged, will try again later ({future.exception()})"
+                        if self._log:
+                            self._logger.error(msg)
+                        print(colorama.Fore.RED + msg)
+                        continue
+                    move_file(entry.path, os.path.join(target, entry.name))
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
-    @classmethod
     def print_meteo(self) -> None:
         try:
-            files = os.listdir(self._source)
-            if files:
-                file = max([x for x in files if "VMSW" in x])
-
+            # most recent short bulletin, found in a single pass over the source directory
+            with os.scandir(self._source) as it:
+                file = max((entry.name for entry in it if "VMSW" in entry.name and entry.is_file()), default=None)
+            if file:
                 data = self.extract_short_bulletin(os.path.join(self._source, file))
                 print(colorama.Fore.GREEN + "%s [%s] zzzztttt: %s tre200s0: %s uor200s0: %s" % \
                       (time.strftime("%Y-%m-%d %H:%M:%S"), self._name,
@@ -137,10 +146,9 @@ class METEO:
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
-    @classmethod
     def extract_short_bulletin(self, file) -> dict:
         """
         Read file and extract meteo data.
@@ -150,12 +158,10 @@ class METEO:
         """
         try:
             if "VMSW" in file:
-                with open(file, "r", encoding='utf8') as fh:
-                    for i in range(3):
-                        fh.readline()
-                    header = fh.readline().split()
-                    data = fh.readline().split()
-                data = dict(zip(header, data))
+                # bulletins are small ASCII files, header in line 4, data in line 5
+                with open(file, "r", encoding='ascii', errors='replace') as fh:
+                    lines = fh.read().splitlines()
+                data = dict(zip(lines[3].split(), lines[4].split()))
             else:
                 data = None
 
@@ -163,7 +169,7 @@ class METEO:
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
 # %%
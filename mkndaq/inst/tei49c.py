@@ -9,12 +9,13 @@ Define a class TEI49C facilitating communication with a Thermo TEI49c instrument
 import logging
 import os
 import shutil
+import threading
 import time
-import zipfile
 import colorama
 import serial
 
 from mkndaq.utils import datetimebin
+from mkndaq.utils.filesync import zip_file
 
 
 class TEI49C:
@@ -24,7 +25,7 @@ class TEI49C:
 
     __datadir = None
     __datafile = None
-    __file_to_stage = None
+    __datafile_fh = None
     __data_header = None
     __get_config = None
     __get_data = None
@@ -34,10 +35,13 @@ class TEI49C:
     __name = None
     __reporting_interval = None
     __serial = None
+    __response_timeout = 2
     __set_config = None
     _simulate = None
     __staging = None
+    __stage_dir = None
     __zip = False
+    __compresslevel = 1
 
     def __init__(self, name: str, config: dict, simulate=False) -> None:
         """
@@ -64,24 +68,17 @@ class TEI49C:
             - config['logs']: default=True, write information to logfile
             - config['staging']['path']
             - config['staging']['zip']
+            - config[name]['staging_compresslevel']: default=1, DEFLATE level of staged zip files, 0: store uncompressed
         :param simulate: default=True, simulate instrument behavior. Assumes a serial loopback connector.
         """
         colorama.init(autoreset=True)
 
         try:
             self._simulate = simulate
-            # setup logging
+            # logging is configured once by the application
             if 'logs' in config.keys():
                 self._log = True
-                logs = os.path.expanduser(config['logs'])
-                os.makedirs(logs, exist_ok=True)
-                logfile = f"{time.strftime('%Y%m%d')}.log"
                 self._logger = logging.getLogger(__name__)
-                logging.basicConfig(level=logging.DEBUG,
-                                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                                    datefmt='%y-%m-%d %H:%M:%S',
-                                    filename=str(os.path.join(logs, logfile)),
-                                    filemode='a')
 
             # read instrument control properties for later use
             self.__name = name
@@ -102,8 +99,11 @@ class TEI49C:
                                             parity=config[port]['parity'],
                                             stopbits=config[port]['stopbits'],
                                             timeout=config[port]['timeout'])
-                if self.__serial.is_open:
-                    self.__serial.close()
+                # the port is kept open for the lifetime of the instance, see .close()
+                if not self.__serial.is_open:
+                    self.__serial.open()
+            # serializes access to the serial port, which is shared by scheduled jobs running in threads
+            self.__lock = threading.Lock()
 
             # sampling, aggregation, reporting/storage
             # self._sampling_interval = config[name]['sampling_interval']
@@ -116,7 +116,10 @@ class TEI49C:
 
             # staging area for files to be transfered
             self.__staging = os.path.expanduser(config['staging']['path'])
+            self.__stage_dir = os.path.join(self.__staging, os.path.basename(self.__datadir))
+            os.makedirs(self.__stage_dir, exist_ok=True)
             self.__zip = config[name]['staging_zip']
+            self.__compresslevel = config[name].get('staging_compresslevel', 1)
 
             print(f"# Initialize TEI49C (name: {self.__name}  S/N: {self.__serial_number})")
             self.get_config()
@@ -124,7 +127,7 @@ class TEI49C:
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
 
@@ -137,34 +140,115 @@ class TEI49C:
         :return: response of instrument, decoded
         """
         __id = bytes([self.__id])
-        rcvd = b''
         try:
             if self._simulate:
                 __id = b''
-            self.__serial.write(__id + (f"{cmd}\x0D").encode())
-            time.sleep(0.5)
-            while self.__serial.in_waiting > 0:
-                rcvd = rcvd + self.__serial.read(1024)
-                time.sleep(0.1)
+            frame = __id + (f"{cmd}\x0D").encode()
+            with self.__lock:
+                try:
+                    rcvd = self._transceive(frame)
+                except serial.SerialException:
+                    # reopen the port after a transient failure and try once more
+                    self.__serial.close()
+                    self.__serial.open()
+                    rcvd = self._transceive(frame)
 
-            rcvd = rcvd.decode()
             if tidy:
-                # - remove checksum after and including the '*'
-                rcvd = rcvd.split("*")[0]
                 # - remove echo before and including '\n'
-                if cmd.join("\n") in rcvd:
-                    # rcvd = rcvd.split("\n")[1]
-                    rcvd = rcvd.replace(cmd, "")
+                echo = (f"{cmd}\n").encode()
+                if rcvd.startswith(echo):
+                    rcvd = rcvd[len(echo):]
+                # - remove checksum after and including the '*'
+                rcvd = rcvd.split(b"*")[0]
                 # remove trailing '\r\n'
-                # rcvd = rcvd.rstrip()
                 rcvd = rcvd.strip()
-            return rcvd
+            return rcvd.decode()
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
+    def _transceive(self, frame: bytes) -> bytearray:
+        """
+        Write a command frame to the open serial port and read the response.
+
+        :param frame: command, including id and terminating '\r'
+        :return: raw response of instrument
+        """
+        rcvd = bytearray()
+        # discard anything left over from a previous response
+        self.__serial.reset_input_buffer()
+        self.__serial.write(frame)
+
+        # block until the response is terminated by '\r'. The instrument is given some time to respond, and to
+        # continue after a pause; long responses (lrec) are read as long as data keeps arriving.
+        deadline = time.monotonic() + self.__response_timeout
+        while not rcvd.endswith(b'\r') and time.monotonic() < deadline:
+            data = self.__serial.read_until(b'\r', 4096)
+            if data:
+                rcvd += data
+                deadline = time.monotonic() + self.__response_timeout
+        return rcvd
+
+    def _open_datafile(self, datafile: str) -> None:
+        """
+        Close the current data file and open datafile for appending. The file is line-buffered and stays
+        open until the next data file is opened. A header is written to new files. The previous data file
+        is complete at this point and is staged for transfer.
+
+        :param datafile: full path of data file
+        :return:
+        """
+        if self.__datafile_fh is not None:
+            self.__datafile_fh.close()
+            self.__datafile_fh = None
+        previous = self.__datafile
+
+        os.makedirs(os.path.dirname(datafile), exist_ok=True)
+        self.__datafile_fh = open(datafile, "at", encoding='utf8', buffering=1)
+        if self.__datafile_fh.tell() == 0:
+            # new file, write header
+            self.__datafile_fh.write(f"{self.__data_header}\n")
+        self.__datafile = datafile
+
+        if previous is not None and previous != datafile:
+            try:
+                self._stage_datafile(previous)
+            except Exception as err:
+                if self._log:
+                    self._logger.error("%s", err)
+                print(err)
+
+    def _stage_datafile(self, datafile: str) -> None:
+        """
+        Stage a completed data file for transfer, compressed if so configured.
+
+        :param datafile: full path of data file
+        :return:
+        """
+        if self.__zip:
+            # create zip file
+            archive = os.path.join(self.__stage_dir, "".join([os.path.basename(datafile)[:-4], ".zip"]))
+            zip_file(datafile, archive, compresslevel=self.__compresslevel)
+        else:
+            shutil.copyfile(datafile, os.path.join(self.__stage_dir, os.path.basename(datafile)))
+
+    def close(self) -> None:
+        """
+        Close the serial port and the current data file.
+
+        :return:
+        """
+        if self.__serial is not None and self.__serial.is_open:
+            self.__serial.close()
+        if self.__datafile_fh is not None:
+            self.__datafile_fh.close()
+            self.__datafile_fh = None
+
+    def __del__(self) -> None:
+        self.close()
+
     # def test_serial_comm(self, cmd: str, tidy=True, sleep=0.1, debug=False) -> str:
     #     """
     #     Send a command and retrieve the response. Assumes an open connection.
@@ -216,19 +300,17 @@ class TEI49C:
         print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} .get_config (name={self.__name})")
         cfg = []
         try:
-            self.__serial.open()
             for cmd in self.__get_config:
                 cfg.append(self.serial_comm(cmd))
-            self.__serial.close()
 
             if self._log:
-                self._logger.info(f"Current configuration of '{self.__name}': {cfg}")
+                self._logger.info("Current configuration of '%s': %s", self.__name, cfg)
 
             return cfg
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
     def set_datetime(self) -> None:
@@ -254,7 +336,7 @@ class TEI49C:
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
     def set_config(self) -> list:
@@ -266,21 +348,19 @@ class TEI49C:
         print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} .set_config (name={self.__name})")
         cfg = []
         try:
-            self.__serial.open()
             self.set_datetime()
             for cmd in self.__set_config:
                 cfg.append(self.serial_comm(cmd))
-            self.__serial.close()
             time.sleep(1)
 
             if self._log:
-                self._logger.info(f"Configuration of '{self.__name}' set to: {cfg}")
+                self._logger.info("Configuration of '%s' set to: %s", self.__name, cfg)
 
             return cfg
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
     def get_data(self, cmd=None, save=True) -> str:
@@ -304,87 +384,47 @@ class TEI49C:
             if self._simulate:
                 data = self.simulate__get_data(cmd)
             else:
-                if self.__serial.is_open:
-                    self.__serial.close()
-
-                self.__serial.open()
                 data = self.serial_comm(cmd)
-                self.__serial.close()
 
             if save:
                 # generate the datafile name
                 # self.__datafile = os.path.join(self.__datadir,
                 #                              "".join([self.__name, "-",
                 #                                       datetimebin.dtbin(self.__reporting_interval), ".dat"]))
-                self.__datafile = os.path.join(self.__datadir, time.strftime("%Y"), time.strftime("%m"), time.strftime("%d"),
-                                             "".join([self.__name, "-",
-                                                      datetimebin.dtbin(self.__reporting_interval), ".dat"]))
-
-                os.makedirs(os.path.dirname(self.__datafile), exist_ok=True)
-                if not os.path.exists(self.__datafile):
-                    # if file doesn't exist, create and write header
-                    with open(self.__datafile, "at", encoding='utf8') as fh:
-                        fh.write(f"{self.__data_header}\n")
-                        fh.close()
-                with open(self.__datafile, "at", encoding='utf8') as fh:
-                    # add data to file
-                    fh.write(f"{dtm} {data}\n")
-                    fh.close()
+                datafile = os.path.join(self.__datadir, time.strftime("%Y"), time.strftime("%m"), time.strftime("%d"),
+                                        "".join([self.__name, "-",
+                                                 datetimebin.dtbin(self.__reporting_interval), ".dat"]))
+                if datafile != self.__datafile or self.__datafile_fh is None:
+                    self._open_datafile(datafile)
 
-                # stage data for transfer
-                # root = os.path.join(self.__staging, os.path.basename(self.__datadir))
-                # os.makedirs(root, exist_ok=True)
-                # if self.__zip:
-                #     # create zip file
-                #     archive = os.path.join(root, "".join([os.path.basename(self.__datafile)[:-4], ".zip"]))
-                #     with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as fh:
-                #         fh.write(self.__datafile, os.path.basename(self.__datafile))
-                # else:
-                #     shutil.copyfile(self.__datafile, os.path.join(root, os.path.basename(self.__datafile)))
-                if self.__file_to_stage is None:
-                    self.__file_to_stage = self.__datafile
-                elif self.__file_to_stage != self.__datafile:
-                    root = os.path.join(self.__staging, os.path.basename(self.__datadir))
-                    os.makedirs(root, exist_ok=True)
-                    if self.__zip:
-                        # create zip file
-                        archive = os.path.join(root, "".join([os.path.basename(self.__file_to_stage)[:-4], ".zip"]))
-                        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                            zf.write(self.__file_to_stage, os.path.basename(self.__file_to_stage))
-                    else:
-                        shutil.copyfile(self.__file_to_stage, os.path.join(root, os.path.basename(self.__file_to_stage)))
-                    self.__file_to_stage = self.__datafile
+                # add data to file
+                self.__datafile_fh.write(f"{dtm} {data}\n")
 
             return data
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
     def get_o3(self) -> str:
         try:
-            self.__serial.open()
-            o3 = self.serial_comm('O3')
-            self.__serial.close()
-            return o3
+            return self.serial_comm('O3')
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
     def print_o3(self) -> None:
         try:
-            self.__serial.open()
             o3 = self.serial_comm('O3').split()
-            self.__serial.close()
 
             print(colorama.Fore.GREEN + f"{time.strftime('%Y-%m-%d %H:%M:%S')} [{self.__name}] {o3[0].upper()} {str(float(o3[1]))} {o3[2]}")
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(colorama.Fore.RED + f"{time.strftime('%Y-%m-%d %H:%M:%S')} [{self.__name}] produced error {err}.")
 
     def simulate_get_data(self, cmd=None) -> str:
@@ -422,10 +462,6 @@ class TEI49C:
 
             print("%s .get_all_rec (name=%s, save=%s)" % (dtm, self.__name, save))
 
-            # close potentially open port
-            if self.__serial.is_open:
-                self.__serial.close()
-
             # retrieve data from instrument
             for i in [0, 1]:
                 index = CAPACITY[i]
@@ -441,9 +477,7 @@ class TEI49C:
                         retrieve = index
                     cmd = f"{CMD[i]} {str(index)} {str(retrieve)}"
                     print(cmd)
-                    self.__serial.open()
                     data = self.serial_comm(cmd)
-                    self.__serial.close()
 
                     if save:
                         if not os.path.exists(datafile):
@@ -459,21 +493,18 @@ class TEI49C:
                     index = index - 10
 
                 # stage data for transfer
-                root = os.path.join(self.__staging, os.path.basename(self.__datadir))
-                os.makedirs(root, exist_ok=True)
                 if self.__zip:
                     # create zip file
-                    archive = os.path.join(root, "".join([os.path.basename(datafile[:-4]), ".zip"]))
-                    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as fh:
-                        fh.write(datafile, os.path.basename(datafile))
+                    archive = os.path.join(self.__stage_dir, "".join([os.path.basename(datafile[:-4]), ".zip"]))
+                    zip_file(datafile, archive, compresslevel=self.__compresslevel)
                 else:
-                    shutil.copyfile(datafile, os.path.join(root, os.path.basename(datafile)))
+                    shutil.copyfile(datafile, os.path.join(self.__stage_dir, os.path.basename(datafile)))
 
             return 0
 
         except Exception as err:
             if self._log:
-                self._logger.error(err)
+                self._logger.error("%s", err)
             print(err)
 
 
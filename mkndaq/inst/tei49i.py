@@ -5,18 +5,25 @@ Define a class TEI49I facilitating communication with a Thermo TEI49i instrument
 @author: joerg.klausen@meteoswiss.ch
 """
 
+import concurrent.futures
 import logging
+import logging.handlers
 import os
 import shutil
 import socket
 import re
+import select
 import serial
+import threading
 import time
-import zipfile
 
 import colorama
 
 from mkndaq.utils import datetimebin
+from mkndaq.utils.filesync import zip_file
+
+# wraps sys.stdout/sys.stderr; do this once, not per instance
+colorama.init(autoreset=True)
 
 
 class TEI49I:
@@ -24,23 +31,40 @@ class TEI49I:
     Instrument of type Thermo TEI 49I with methods, attributes for interaction.
     """
 
+    # field labels in lrec responses, e.g.
+    # 05:26 07-19-22 flags 0C100400 o3 30.781 hio3 0.000 cellai 50927 cellbi 51732 bncht 29.9 lmpt 53.1 o3lt 0.0 ...
+    _LABEL_RE = re.compile(r'\b(flags|hio3|cellai|cellbi|bncht|lmpt|o3lt|flowa|flowb|pres|o3) ')
+    _NUM_RE = re.compile(r'(\d+)')
+    # responses end with '\r', possibly followed by '\x00'
+    _TERM_RE = re.compile('\r\x00?')
+    # number of records requested per lrec command
+    _LREC_BATCH = 10
+
     __datadir = None
     __datafile = ""
+    __datafile_fh = None
+    __datafile_key = None
+    __datafile_open = None
     __file_to_stage = None
     __data_header = None
     __get_config = None
     __get_data = None
+    __frames = None
     __id = None
     _log = None
     _logger = None
+    __compresslevel = 1
     __name = None
     _reporting_interval = None
+    __response_timeout = 2
     _serial_com = None
     __set_config = None
     _simulate = None
+    _sock = None
     __sockaddr = None
     __socksleep = None
     __socktout = None
+    _stage_pool = None
     __staging = None
     __zip = False
 
@@ -66,10 +90,10 @@ class TEI49I:
             - config[name]['sampling_interval']
             - config['staging']['path'])
             - config[name]['staging_zip']
+            - config[name]['staging_compresslevel']: default=1, DEFLATE level of staged zip files, 0: store uncompressed
         :param serial: default=False, Use serial (RS232) communication.
         :param simulate: default=True, simulate instrument behavior. Assumes a serial loopback connector.
         """
-        colorama.init(autoreset=True)
         # print(f"# Initialize TEI49I (name: {name})")
 
         try:
@@ -80,13 +104,19 @@ class TEI49I:
                 self._log = True
                 logs = os.path.expanduser(config['logs'])
                 os.makedirs(logs, exist_ok=True)
-                logfile = f"{time.strftime('%Y%m%d')}.log"
                 self._logger = logging.getLogger(__name__)
-                logging.basicConfig(level=logging.DEBUG,
-                                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                                    datefmt='%y-%m-%d %H:%M:%S',
-                                    filename=str(os.path.join(logs, logfile)),
-                                    filemode='a')
+                if not self._logger.handlers:
+                    # shared by all instances; rolls over at midnight, and the completed log is staged for transfer
+                    handler = logging.handlers.TimedRotatingFileHandler(filename=os.path.join(logs, "tei49i.log"),
+                                                                        when='midnight', backupCount=30)
+                    handler.setFormatter(logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                                                           datefmt='%y-%m-%d %H:%M:%S'))
+                    handler.namer = self._log_name
+                    handler.rotator = self._rotate_log
+                    self._logger.addHandler(handler)
+                    self._logger.setLevel(logging.DEBUG)
+                    # records go to tei49i.log only, not to the application log as well
+                    self._logger.propagate = False
 
             # read instrument control properties for later use
             self.__name = name
@@ -97,6 +127,10 @@ class TEI49I:
             self.__set_config = config[name]['set_config']
             self.__get_data = config[name]['get_data']
             self.__data_header = config[name]['data_header']
+            # frames of the commands sent repeatedly
+            self.__frames = {}
+            for cmd in self.__get_config + self.__set_config + [self.__get_data, 'o3', 'O3', 'no of lrec']:
+                self.__frames[cmd] = self._frame(cmd)
 
             if self._serial_com:
                 # configure serial port
@@ -117,6 +151,10 @@ class TEI49I:
                                 config[name]['socket']['port'])
                 self.__socktout = config[name]['socket']['timeout']
                 self.__socksleep = config[name]['socket']['sleep']
+                # the connection is opened on first use and kept open, see .close()
+                self._sock = None
+            # serializes access to the connection, which is shared by scheduled jobs running in threads
+            self._lock = threading.Lock()
 
             # sampling, aggregation, reporting/storage
             self._sampling_interval = config[name]['sampling_interval']
@@ -130,6 +168,9 @@ class TEI49I:
             # staging area for files to be transfered
             self.__staging = os.path.expanduser(config['staging']['path'])
             self.__zip = config[name]['staging_zip']
+            self.__compresslevel = config[name].get('staging_compresslevel', 1)
+            # files are staged in the background, one at a time, so as not to delay data acquisition
+            self._stage_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
             print(f"# Initialize TEI49I (name: {self.__name}  S/N: {self.__serial_number})")
             self.get_config()
@@ -149,41 +190,17 @@ class TEI49I:
         :param tidy: remove cmd echo, \n and *\r\x00 from result string, terminate with \n
         :return: response of instrument, decoded
         """
-        __id = bytes([self.__id])
         rcvd = b''
         try:
-            # open socket connection as a client
             if self._simulate:
                 rcvd = self.simulate__get_data(cmd).encode()
             else:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM, ) as s:
-                    # connect to the server
-                    s.settimeout(self.__socktout)
-                    s.connect(self.__sockaddr)
-
-                    if self._simulate:
-                        __id = b''
-
-                    # send data
-                    s.sendall(__id + (f"{cmd}\x0D").encode())
-                    time.sleep(self.__socksleep)
-
-                    # receive response
-                    while True:
-                        data = s.recv(1024)
-                        rcvd = rcvd + data
-                        if b'\x0D' in data:
-                            break
+                rcvd = self._transceive(self._frame(cmd))
 
             # decode response, tidy
             rcvd = rcvd.decode()
             if tidy:
-                # - remove checksum after and including the '*'
-                rcvd = rcvd.split("*")[0]
-                # - remove echo before and including '\n'
-                rcvd = rcvd.replace(f"{cmd}\n", "")
-                # if "\n" in rcvd:
-                    # rcvd = rcvd.split("\n")[1]
+                rcvd = self._tidy(cmd, rcvd)
 
             # TODO: test with local instrument
             # if rcvd is None:
@@ -197,6 +214,307 @@ class TEI49I:
             print(err)
 
 
+    def tcpip_comm_batch(self, cmds: list, tidy=True) -> list:
+        """
+        Send several commands in one go and retrieve their responses.
+
+        The commands are sent back-to-back, each terminated by \r, and the responses are read until all of them have
+        been received. This saves a round-trip per command compared to calling .tcpip_comm() repeatedly.
+
+        :param cmds: commands sent to instrument
+        :param tidy: remove cmd echo, \n and *\r\x00 from result strings
+        :return: responses of instrument, decoded, in the order of cmds
+        """
+        try:
+            if self._simulate:
+                return [self.tcpip_comm(cmd, tidy=tidy) for cmd in cmds]
+            if not cmds:
+                return []
+
+            payload = b''.join(self._frame(cmd) for cmd in cmds)
+            rcvd = self._transceive(payload, count=len(cmds)).decode()
+
+            # each response is terminated by \r, possibly followed by \x00
+            responses = self._TERM_RE.split(rcvd)[:len(cmds)]
+            if tidy:
+                responses = [self._tidy(cmd, response) for cmd, response in zip(cmds, responses)]
+            return responses
+
+        except Exception as err:
+            if self._log:
+                self._logger.error(err)
+            print(err)
+
+
+    def _frame(self, cmd: str) -> bytes:
+        """
+        Frame a command for sending, i.e., prefix the instrument id and terminate with \r. Frames of the
+        configured commands are built once, others on the fly.
+
+        :param cmd: command sent to instrument
+        :return: framed command
+        """
+        if self.__frames:
+            frame = self.__frames.get(cmd)
+            if frame is not None:
+                return frame
+        # the simulator (serial loopback) expects no id
+        __id = b'' if self._simulate else bytes([self.__id])
+        return __id + (f"{cmd}\x0D").encode()
+
+
+    def _transceive(self, payload: bytes, count=1) -> bytes:
+        """
+        Send payload on the (persistent) connection and read the response(s).
+
+        On a timeout or if the connection has gone stale, it is re-opened and the exchange is tried once more.
+        Errors are left to the caller to report.
+
+        :param payload: framed command(s)
+        :param count: number of responses expected
+        :return: raw response(s)
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    reused = self._sock is not None
+                    s = self._ensure_connected()
+                    if reused:
+                        # discard what is left of the previous response
+                        self._drain(s)
+
+                    # send data
+                    s.sendall(payload)
+                    # wait for the response to become available, at most socksleep seconds;
+                    # recv() below blocks until it arrives anyway (bounded by the socket timeout)
+                    select.select([s], [], [], self.__socksleep)
+
+                    # receive response; a '\x00' trailing the previous response may only arrive now
+                    return self._recv_response(s, count=count).lstrip(b'\x00')
+
+                except (socket.timeout, ConnectionError):
+                    # transient, reconnect and retry
+                    self._disconnect()
+                    if attempt > 0:
+                        raise
+
+                except Exception:
+                    # state of the connection is unknown, don't re-use it
+                    self._disconnect()
+                    raise
+
+
+    @staticmethod
+    def _tidy(cmd: str, rcvd: str) -> str:
+        """
+        Remove checksum and command echo from a response.
+
+        :param cmd: command sent to instrument
+        :param rcvd: decoded response
+        :return: tidied response
+        """
+        # - remove checksum after and including the '*'
+        rcvd = rcvd.split("*")[0]
+        # - remove echo before and including '\n'
+        rcvd = rcvd.replace(f"{cmd}\n", "")
+        # if "\n" in rcvd:
+            # rcvd = rcvd.split("\n")[1]
+        return rcvd
+
+
+    def _ensure_connected(self) -> socket.socket:
+        """
+        Connect to the instrument, unless a connection is already open.
+
+        :return: connected socket
+        """
+        if self._sock is None:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.settimeout(self.__socktout)
+            # commands are tiny request/response frames; don't let Nagle hold them back
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # large enough to take a complete lrec download; set before connecting, so the window is scaled to match
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            try:
+                s.connect(self.__sockaddr)
+            except OSError:
+                s.close()
+                raise
+            self._sock = s
+        return self._sock
+
+
+    def _drain(self, s: socket.socket) -> None:
+        """
+        Discard bytes pending on the socket, e.g., a '\x00' that arrived after the '\r' of the previous response.
+
+        :param s: connected socket
+        :return:
+        """
+        s.setblocking(False)
+        try:
+            while True:
+                try:
+                    data = s.recv(4096)
+                except (BlockingIOError, InterruptedError):
+                    return
+                if not data:
+                    raise ConnectionError("Connection closed by instrument.")
+        finally:
+            s.settimeout(self.__socktout)
+
+
+    def _recv_response(self, s: socket.socket, count=1) -> bytes:
+        """
+        Read from the socket until count response terminators (\r) have been received.
+
+        Data is read into a buffer sized for a typical short response, which doubles whenever it is full. Only
+        newly received bytes are searched for terminators.
+
+        :param s: connected socket
+        :param count: number of responses expected
+        :return: raw response(s), including the terminator(s)
+        """
+        buf = bytearray(512)
+        mv = memoryview(buf)
+        off = 0
+        seen = 0
+        try:
+            while True:
+                if off == len(buf):
+                    # a memoryview pins the buffer's size; release it while doubling the buffer
+                    mv.release()
+                    buf.extend(bytes(len(buf)))
+                    mv = memoryview(buf)
+                if hasattr(socket, 'TCP_QUICKACK'):
+                    # Linux only, and not sticky: re-arm before every read
+                    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+                n = s.recv_into(mv[off:])
+                if n == 0:
+                    raise ConnectionError("Connection closed by instrument.")
+                seen += buf.count(b'\x0D', off, off + n)
+                off += n
+                if seen >= count:
+                    return bytes(mv[:off])
+        finally:
+            mv.release()
+
+
+    def close(self) -> None:
+        """
+        Close the connection to the instrument and the current data file, and wait for pending staging jobs.
+
+        :return:
+        """
+        self._disconnect()
+        self._close_datafile()
+        if self._stage_pool is not None:
+            self._stage_pool.shutdown(wait=True)
+            self._stage_pool = None
+
+
+    def _disconnect(self) -> None:
+        """
+        Close the connection to the instrument, if open.
+
+        :return:
+        """
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+
+
+    def _open_datafile(self, datafile: str) -> None:
+        """
+        Close the current data file and open datafile for appending. The file is line-buffered and stays open
+        until the next data file is opened. A header is written to new files.
+
+        :param datafile: full path of data file
+        :return:
+        """
+        self._close_datafile()
+        os.makedirs(os.path.dirname(datafile), exist_ok=True)
+        self.__datafile_fh = open(datafile, "at", encoding='utf8', buffering=1)
+        if self.__datafile_fh.tell() == 0:
+            # new file, write header
+            self.__datafile_fh.write(f"{self.__data_header}\n")
+        self.__datafile_open = datafile
+
+
+    def _close_datafile(self) -> None:
+        """
+        Close the current data file, if open. The file is flushed to disk first, since it is complete and
+        about to be staged.
+
+        :return:
+        """
+        if self.__datafile_fh is not None:
+            try:
+                self.__datafile_fh.flush()
+                os.fsync(self.__datafile_fh.fileno())
+            finally:
+                self.__datafile_fh.close()
+                self.__datafile_fh = None
+                self.__datafile_open = None
+
+
+    def _stage_file(self, src: str, zip_it: bool) -> None:
+        """
+        Stage a completed data file for transfer, compressed if so requested. Runs on the staging thread.
+
+        :param src: full path of data file
+        :param zip_it: compress file
+        :return:
+        """
+        try:
+            root = os.path.join(self.__staging, os.path.basename(self.__datadir))
+            os.makedirs(root, exist_ok=True)
+            if zip_it:
+                # create zip file
+                archive = os.path.join(root, "".join([os.path.splitext(os.path.basename(src))[0], ".zip"]))
+                zip_file(src, archive, compresslevel=self.__compresslevel)
+            else:
+                shutil.copyfile(src, os.path.join(root, os.path.basename(src)))
+
+        except Exception as err:
+            if self._log:
+                self._logger.error(err)
+            print(err)
+
+
+    @staticmethod
+    def _log_name(default_name: str) -> str:
+        """
+        Name a rolled-over log file tei49i.<date>.log rather than tei49i.log.<date>, so that it is staged
+        under a name of its own.
+
+        :param default_name: full path of rolled-over log file, as named by the handler
+        :return: full path of rolled-over log file
+        """
+        root, date = os.path.splitext(default_name)
+        return "".join([os.path.splitext(root)[0], date, ".log"])
+
+
+    def _rotate_log(self, source: str, dest: str) -> None:
+        """
+        Roll over the log file, and stage the completed log for transfer.
+
+        :param source: full path of current log file
+        :param dest: full path of rolled-over log file
+        :return:
+        """
+        if os.path.exists(source):
+            os.replace(source, dest)
+            if self._stage_pool is not None:
+                self._stage_pool.submit(self._stage_file, src=dest, zip_it=self.__zip)
+
+
+    def __del__(self) -> None:
+        self.close()
+
+
     def serial_comm(self, cmd: str, tidy=True) -> str:
         """
         Send a command and retrieve the response. Assumes an open connection.
@@ -205,29 +523,33 @@ class TEI49I:
         :param tidy: remove echo and checksum after '*'
         :return: response of instrument, decoded
         """
-        __id = bytes([self.__id])
         rcvd = b''
         try:
-            if self._simulate:
-                __id = b''
-            self.__serial.write(__id + (f"{cmd}\x0D").encode())
-            time.sleep(0.5)
-            while self.__serial.in_waiting > 0:
-                rcvd = rcvd + self.__serial.read(1024)
-                time.sleep(0.1)
+            # discard anything left over from a previous response
+            self.__serial.reset_input_buffer()
+            self.__serial.write(self._frame(cmd))
+            # block until the response is terminated by '\r'. The instrument is given some time to respond, and to
+            # continue after a pause; long responses (lrec) are read as long as data keeps arriving. The size limit
+            # guards against a stream of garbage without terminator.
+            rcvd = bytearray()
+            deadline = time.monotonic() + self.__response_timeout
+            while not rcvd.endswith(b'\x0D') and len(rcvd) < 8192 and time.monotonic() < deadline:
+                data = self.__serial.read_until(b'\x0D', 8192 - len(rcvd))
+                if data:
+                    rcvd += data
+                    deadline = time.monotonic() + self.__response_timeout
+            rcvd = bytes(rcvd)
 
-            rcvd = rcvd.decode()
             if tidy:
-                # - remove checksum after and including the '*'
-                rcvd = rcvd.split("*")[0]
                 # - remove echo before and including '\n'
-                if cmd.join("\n") in rcvd:
-                    # rcvd = rcvd.split("\n")[1]
-                    rcvd = rcvd.replace(cmd, "")
+                echo = (f"{cmd}\n").encode()
+                if rcvd.startswith(echo):
+                    rcvd = rcvd[len(echo):]
+                # - remove checksum after and including the '*'
+                rcvd = rcvd.split(b"*")[0]
                 # remove trailing '\r\n'
-                # rcvd = rcvd.rstrip()
                 rcvd = rcvd.strip()
-            return rcvd
+            return rcvd.decode()
 
         except Exception as err:
             if self._log:
@@ -245,11 +567,14 @@ class TEI49I:
         print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} .get_config (name={self.__name})")
         cfg = []
         try:
-            for cmd in self.__get_config:
-                if self._serial_com:
-                    cfg.append(self.serial_comm(cmd))
-                else:
-                    cfg.append(self.tcpip_comm(cmd))
+            if self._serial_com:
+                for cmd in self.__get_config:
+                    rcvd = self.serial_comm(cmd)
+                    if rcvd is not None:
+                        cfg.append(rcvd)
+            else:
+                # None if the exchange failed (already reported)
+                cfg = self.tcpip_comm_batch(self.__get_config) or []
 
             if self._log:
                 self._logger.info(f"Current configuration of '{self.__name}': {cfg}")
@@ -274,7 +599,7 @@ class TEI49I:
                 dte = self.serial_comm(cmd)
             else:
                 dte = self.tcpip_comm(cmd)
-            msg = f"Date of instrument {self._name} set to: {dte}"
+            msg = f"Date of instrument {self.__name} set to: {dte}"
             print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {msg}")
             self._logger.info(msg)
 
@@ -304,10 +629,12 @@ class TEI49I:
         try:
             for cmd in self.__set_config:
                 if self._serial_com:
-                    cfg.append(self.serial_comm(cmd))
+                    rcvd = self.serial_comm(cmd)
                 else:
-                    cfg.append(self.tcpip_comm(cmd))
-                time.sleep(1)
+                    rcvd = self.tcpip_comm(cmd)
+                # None if the exchange failed (already reported)
+                if rcvd is not None:
+                    cfg.append(rcvd)
 
             if self._log:
                 self._logger.info(f"Configuration of '{self.__name}' set to: {cfg}")
@@ -329,9 +656,11 @@ class TEI49I:
         :return str response as decoded string
         """
         try:
-            dtm = time.strftime('%Y-%m-%d %H:%M:%S')
+            now = time.time()
+            tm = time.localtime(now)
+            dtm = time.strftime('%Y-%m-%d %H:%M:%S', tm)
             if self._simulate:
-                print("%s .get_data (name=%s, save=%s, simulate=%s)" % (dtm, self._name, save, self._simulate))
+                print("%s .get_data (name=%s, save=%s, simulate=%s)" % (dtm, self.__name, save, self._simulate))
             else:
                 print("%s .get_data (name=%s, save=%s)" % (dtm, self.__name, save))
 
@@ -343,28 +672,25 @@ class TEI49I:
             else:
                 data = self.tcpip_comm(cmd)
 
-            if self._simulate:
-                data = self.simulate__get_data(cmd)
-
             if save:
                 # generate the datafile name
                 # self.__datafile = os.path.join(self.__datadir, 
                 #                              "".join([self.__name, "-",
                 #                                       datetimebin.dtbin(self._reporting_interval), ".dat"]))
-                self.__datafile = os.path.join(self.__datadir, time.strftime("%Y"), time.strftime("%m"), time.strftime("%d"),
-                                             "".join([self.__name, "-",
-                                                      datetimebin.dtbin(self._reporting_interval), ".dat"]))
-
-                os.makedirs(os.path.dirname(self.__datafile), exist_ok=True)
-
-                if not os.path.exists(self.__datafile):
-                    # if file doesn't exist, create and write header
-                    with open(self.__datafile, "at", encoding='utf8') as fh:
-                        fh.write(f"{self.__data_header}\n")
-                        fh.close()
-                with open(self.__datafile, "at", encoding='utf8') as fh:
-                    fh.write(f"{dtm} {data}\n")
-                    fh.close()
+                # the name only changes with the day or the reporting interval, so build it only then
+                key = (tm.tm_year, tm.tm_mon, tm.tm_mday, int(now // (self._reporting_interval * 60)))
+                if key != self.__datafile_key:
+                    self.__datafile = os.path.join(self.__datadir, f"{tm.tm_year:04d}", f"{tm.tm_mon:02d}",
+                                                   f"{tm.tm_mday:02d}",
+                                                   "".join([self.__name, "-",
+                                                            datetimebin.dtbin(self._reporting_interval, now), ".dat"]))
+                    self.__datafile_key = key
+
+                if self.__datafile != self.__datafile_open:
+                    self._open_datafile(self.__datafile)
+
+                # add data to file
+                self.__datafile_fh.write(f"{dtm} {data}\n")
 
                 # stage data for transfer
                 # root = os.path.join(self.__staging, os.path.basename(self.__datadir))
@@ -379,15 +705,7 @@ class TEI49I:
                 if self.__file_to_stage is None:
                     self.__file_to_stage = self.__datafile
                 elif self.__file_to_stage != self.__datafile:
-                    root = os.path.join(self.__staging, os.path.basename(self.__datadir))
-                    os.makedirs(root, exist_ok=True)
-                    if self.__zip:
-                        # create zip file
-                        archive = os.path.join(root, "".join([os.path.basename(self.__file_to_stage)[:-4], ".zip"]))
-                        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                            zf.write(self.__file_to_stage, os.path.basename(self.__file_to_stage))
-                    else:
-                        shutil.copyfile(self.__file_to_stage, os.path.join(root, os.path.basename(self.__file_to_stage)))
+                    self._stage_pool.submit(self._stage_file, src=self.__file_to_stage, zip_it=self.__zip)
                     self.__file_to_stage = self.__datafile
 
             return data
@@ -413,66 +731,54 @@ class TEI49I:
                 no_of_lrec = self.serial_comm(cmd)
             else:
                 no_of_lrec = self.tcpip_comm(cmd)
-            no_of_lrec = int(re.findall(r"(\d+)", no_of_lrec)[0])
+            no_of_lrec = int(self._NUM_RE.search(no_of_lrec).group(1))
 
+            fh = None
             if save:
                 # generate the datafile name
-                self.__datafile = os.path.join(self.__datadir,
-                                            "".join([self.__name, "_all_lrec-",
-                                                    time.strftime("%Y%m%d%H%M%S"), ".dat"]))
+                lrec_file = os.path.join(self.__datadir,
+                                         "".join([self.__name, "_all_lrec-",
+                                                  time.strftime("%Y%m%d%H%M%S"), ".dat"]))
+                # open once, write each batch as it arrives
+                fh = open(lrec_file, "at", encoding='utf8')
+                if fh.tell() == 0:
+                    # new file, write header
+                    fh.write(f"{self.__data_header}\n")
 
             # retrieve all lrec records stored in buffer
             index = no_of_lrec
-            retrieve = 10
-
-            while index > 0:
-                if index < 10:
-                    retrieve = index
-                cmd = f"lrec {str(index)} {str(retrieve)}"
-                print(cmd)
-                if self._serial_com:
-                    data = self.serial_comm(cmd)
-                else:
-                    data = self.tcpip_comm(cmd)
-
-                # remove all the extra info in the string returned
-                # 05:26 07-19-22 flags 0C100400 o3 30.781 hio3 0.000 cellai 50927 cellbi 51732 bncht 29.9 lmpt 53.1 o3lt 0.0 flowa 0.435 flowb 0.000 pres 493.7
-                data = data.replace("flags ", "")
-                data = data.replace("hio3 ", "")
-                data = data.replace("cellai ", "")
-                data = data.replace("cellbi ", "")
-                data = data.replace("bncht ", "")
-                data = data.replace("lmpt ", "")
-                data = data.replace("o3lt ", "")
-                data = data.replace("flowa ", "")
-                data = data.replace("flowb ", "")
-                data = data.replace("pres ", "")
-                data = data.replace("o3 ", "")
-
-                if save:
-                    if not os.path.exists(self.__datafile):
-                        # if file doesn't exist, create and write header
-                        with open(self.__datafile, "at", encoding='utf8') as fh:
-                            fh.write(f"{self.__data_header}\n")
-                            fh.close()
-
-                    with open(self.__datafile, "at", encoding='utf8') as fh:
+            retrieve = self._LREC_BATCH
+            data = ""
+
+            try:
+                while index > 0:
+                    if index < self._LREC_BATCH:
+                        retrieve = index
+                    cmd = f"lrec {str(index)} {str(retrieve)}"
+                    print(cmd)
+                    if self._serial_com:
+                        data = self.serial_comm(cmd)
+                    else:
+                        data = self.tcpip_comm(cmd)
+                    if data is None:
+                        # communication failed (reported already), keep the records received so far
+                        print(colorama.Fore.RED + f"{dtm} .get_all_lrec (name={self.__name}) stopped at '{cmd}'")
+                        break
+
+                    # remove all the extra info in the string returned
+                    # 05:26 07-19-22 flags 0C100400 o3 30.781 hio3 0.000 cellai 50927 cellbi 51732 bncht 29.9 lmpt 53.1 o3lt 0.0 flowa 0.435 flowb 0.000 pres 493.7
+                    data = self._LABEL_RE.sub("", data)
+                    if fh is not None:
                         fh.write(f"{data}\n")
-                        fh.close()
 
-                index = index - 10
+                    index = index - self._LREC_BATCH
+            finally:
+                if fh is not None:
+                    fh.close()
 
             if save:
                 # stage data for transfer
-                root = os.path.join(self.__staging, os.path.basename(self.__datadir))
-                os.makedirs(root, exist_ok=True)
-                if self.__zip:
-                    # create zip file
-                    archive = os.path.join(root, "".join([os.path.basename(self.__datafile[:-4]), ".zip"]))
-                    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as fh:
-                        fh.write(self.__datafile, os.path.basename(self.__datafile))
-                else:
-                    shutil.copyfile(self.__datafile, os.path.join(root, os.path.basename(self.__datafile)))
+                self._stage_pool.submit(self._stage_file, src=lrec_file, zip_it=self.__zip)
 
             return data
 
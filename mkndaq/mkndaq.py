@@ -27,6 +27,29 @@ def run_threaded(job_func):
     job_thread = threading.Thread(target=job_func)
     job_thread.start()
 
+def _setup_logging(config: dict) -> str:
+    """Configure logging for the application. Instruments only request their logger.
+
+    Args:
+        config (dict): configuration, config['logs'] is the directory for log files
+
+    Returns:
+        str: directory of log files
+    """
+    logs = os.path.expanduser(config['logs'])
+    os.makedirs(logs, exist_ok=True)
+    logfile = os.path.join(logs,
+                            '%s.log' % time.strftime('%Y%m%d'))
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%y-%m-%d %H:%M:%S',
+                        filename=str(logfile),
+                        filemode='a')
+    logging.getLogger('schedule').setLevel(level=logging.ERROR)
+    logging.getLogger('paramiko.transport').setLevel(level=logging.ERROR)
+
+    return logs
+
 def main():
     """Read config file, set up instruments, and launch data acquisition."""
     colorama.init(autoreset=True)
@@ -60,18 +83,8 @@ def main():
     cfg = config(config_file)
 
     # setup logging
-    logs = os.path.expanduser(cfg['logs'])
-    os.makedirs(logs, exist_ok=True)
-    logfile = os.path.join(logs,
-                            '%s.log' % time.strftime('%Y%m%d'))
+    logs = _setup_logging(cfg)
     logger = logging.getLogger(__name__)
-    logging.basicConfig(level=logging.DEBUG,
-                        format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                        datefmt='%y-%m-%d %H:%M:%S',
-                        filename=str(logfile),
-                        filemode='a')
-    logging.getLogger('schedule').setLevel(level=logging.ERROR)
-    logging.getLogger('paramiko.transport').setLevel(level=logging.ERROR)
 
     logger.info("=== mkndaq (%s) started ===" % version)
 
@@ -4,18 +4,20 @@ from datetime import datetime, timezone
 from time import time
 
 
-def dtbin(interval=10) -> str:
+def dtbin(interval=10, t=None) -> str:
     """
     Generate a binned datetime string as suffix for datafiles.
 
     :param interval: minutes
                 How often should a new file be generated? Values allowed are
                 10, 15, 20, 30, 60, 120, 180, 240, 360, 720, 1440
+    :param t: seconds since the epoch, as returned by time.time(). Defaults to now.
     :return:
     """
     try:
         if interval in [10, 15, 20, 30, 60, 120, 180, 240, 360, 720, 1440]:
-            t = time()
+            if t is None:
+                t = time()
             interval *= 60
             nt = (t // interval) * interval + interval
             return datetime.fromtimestamp(nt, timezone.utc).strftime("%Y%m%d%H%M")
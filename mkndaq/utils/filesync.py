@@ -1,12 +1,187 @@
 # %%
 import os
+import concurrent.futures
+import errno
 import datetime
 import time
 import shutil
-from filecmp import dircmp
 import zipfile
 import colorama
 
+# files with these extensions are already compressed and are stored in zip archives as they are
+COMPRESSED_EXTENSIONS = {'.zip', '.gz', '.bz2', '.xz', '.zst'}
+
+# pool shared by all instruments to compress files for staging. zlib releases the GIL while deflating,
+# so files are compressed in parallel.
+zip_pool = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# target directories to which hard-linking failed, e.g., because they are on another file system
+_no_link_dirs = set()
+# errors of os.link() that mean links are not possible to a target directory at all
+_NO_LINK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+
+def zip_file(source: str, archive: str, arcname: str=None, compresslevel: int=1) -> str:
+    """Compress a single file into a new zip archive.
+
+    Args:
+        source (str): full path to file to be compressed
+        archive (str): full path to zip archive to be created
+        arcname (str, optional): name of file in archive. Defaults to basename of source.
+        compresslevel (int, optional): DEFLATE level (1-9), or 0 to store files uncompressed. For ASCII data files,
+            levels above 1 cost much more CPU for little reduction in size. Defaults to 1.
+
+    Returns:
+        str: full path to zip archive
+    """
+    return zip_files([source], archive, None if arcname is None else [arcname], compresslevel)
+
+
+def zip_files(sources: list, archive: str, arcnames: list=None, compresslevel: int=1) -> str:
+    """Compress several files into a single new zip archive.
+
+    The archive is written under a temporary name (archive + ".part") and renamed when complete, so that a
+    partial archive is never picked up for transfer.
+
+    Args:
+        sources (list): full paths to files to be compressed
+        archive (str): full path to zip archive to be created
+        arcnames (list, optional): names of files in archive. Defaults to basenames of sources.
+        compresslevel (int, optional): DEFLATE level (1-9), or 0 to store files uncompressed. Defaults to 1.
+
+    Returns:
+        str: full path to zip archive
+    """
+    if arcnames is None:
+        arcnames = [os.path.basename(source) for source in sources]
+    part = f"{archive}.part"
+    try:
+        with zipfile.ZipFile(part, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as fh:
+            for source, arcname in zip(sources, arcnames):
+                zinfo = zipfile.ZipInfo.from_file(source, arcname)
+                if compresslevel == 0 or os.path.splitext(source)[1].lower() in COMPRESSED_EXTENSIONS:
+                    zinfo.compress_type = zipfile.ZIP_STORED
+                else:
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                    # ZipFile.write() sets this as well, ZipFile.open() does not
+                    zinfo._compresslevel = compresslevel
+                # ZipFile.write() copies in chunks of 8 KiB, use larger chunks to keep zlib busy
+                with open(source, "rb") as src, fh.open(zinfo, "w") as dst:
+                    shutil.copyfileobj(src, dst, 256 * 1024)
+        os.replace(part, archive)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    return archive
+
+
+def _fastcopy(src: str, dst: str) -> None:
+    """Copy the contents of a file.
+
+    Where available, os.copy_file_range copies within the kernel, and lets network file systems copy on the
+    server. Otherwise, or if the file systems don't support it, the file is copied in chunks of 4 MiB.
+
+    Args:
+        src (str): full path to source file
+        dst (str): full path to target file
+    """
+    with open(src, "rb", buffering=0) as fsrc, open(dst, "wb", buffering=0) as fdst:
+        if hasattr(os, 'copy_file_range'):
+            try:
+                sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30)
+                # some file systems (procfs, some FUSE and network mounts) copy nothing from a non-empty file
+                if sent or os.fstat(fsrc.fileno()).st_size == 0:
+                    while sent:
+                        sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30)
+                    return
+            except OSError:
+                # not supported here, continue from the current file positions
+                pass
+        shutil.copyfileobj(fsrc, fdst, 4 * 1024 * 1024)
+
+
+def link_or_copy(src: str, dst: str) -> str:
+    """Stage a file by hard-linking it, which requires no I/O and no space.
+
+    Falls back to copying if linking fails. If links are not possible at all, e.g., because source and target
+    are on different file systems, it stops trying to link to the target directory from then on. Removing the
+    staged file after transfer leaves the source untouched.
+
+    Args:
+        src (str): full path to file to be staged
+        dst (str): full path to staged file
+
+    Returns:
+        str: full path to staged file
+    """
+    tgt_dir = os.path.dirname(dst)
+    if tgt_dir not in _no_link_dirs:
+        try:
+            try:
+                os.link(src, dst)
+            except FileExistsError:
+                # replace a previously staged file of the same name, as a copy would
+                os.remove(dst)
+                os.link(src, dst)
+            return dst
+        except OSError as err:
+            if err.errno in _NO_LINK_ERRNOS:
+                _no_link_dirs.add(tgt_dir)
+    _fastcopy(src, dst)
+    return dst
+
+
+def move_file(src: str, dst: str) -> str:
+    """Move a file by renaming it, which creates no new file and replaces an existing target.
+
+    Falls back to shutil.move (copy and unlink) if source and target are on different file systems.
+
+    Args:
+        src (str): full path to file to be moved
+        dst (str): full path to target file
+
+    Returns:
+        str: full path to target file
+    """
+    try:
+        os.replace(src, dst)
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
+    return dst
+
+
+def _copy_new_files(src: str, tgt: str, now: float, delay: int) -> list:
+    """Copy files in 'src' that are not present in 'tgt' and have not been modified for 'delay' seconds.
+
+    Both directories are listed once. The file type and mtime come from the directory entries, which avoids
+    a separate stat() per file where the platform provides them with the listing.
+
+    Args:
+        src (str): full path to source directory
+        tgt (str): full path to target directory
+        now (float): reference time, seconds since the epoch
+        delay (int): Period (seconds) during which the file must not have been modified.
+
+    Returns:
+        list: list of files with full file copied to target.
+    """
+    files_copied = []
+    tgt_sep = tgt + os.sep
+    with os.scandir(tgt) as it:
+        tgt_names = {entry.name for entry in it}
+    with os.scandir(src) as it:
+        for entry in it:
+            if entry.name in tgt_names or not entry.is_file():
+                continue
+            if (now - entry.stat().st_mtime) > delay:
+                file = f"{tgt_sep}{entry.name}"
+                _fastcopy(entry.path, file)
+                files_copied.append(file)
+    return files_copied
+
 
 # %%
 def rsync(source: str, target: str, buckets: str = [None, "daily", "monthly"], days: int = 1, delay: int=3600) -> list:
@@ -52,26 +227,13 @@ def rsync(source: str, target: str, buckets: str = [None, "daily", "monthly"], d
                 if os.path.exists(src):
                     tgt = os.path.join(target, dte)
                     os.makedirs(tgt, exist_ok=True)
-                    dcmp = dircmp(src, tgt)
-                    for file in dcmp.left_only:
-                        if os.path.isfile(os.path.join(src, file)):
-                            # print(now)
-                            # print(os.path.getmtime(os.path.join(src, file)))
-                            # print(now - os.path.getmtime(os.path.join(src, file)))
-                            if (now - os.path.getmtime(os.path.join(src, file))) > delay:
-                                shutil.copy(os.path.join(src, file), os.path.join(tgt, file))
-                                files_copied.append(os.path.join(tgt, file))
+                    files_copied.extend(_copy_new_files(src, tgt, now, delay))
                 else:
                     print(f"'{src}' does not exist.")
         else:
             if os.path.exists(source):
                 os.makedirs(target, exist_ok=True)
-                dcmp = dircmp(source, target)
-                for file in dcmp.left_only:
-                    if os.path.isfile(os.path.join(source, file)):
-                        if (now - os.path.getmtime(os.path.join(source, file))) > delay:
-                            shutil.copy(os.path.join(source, file), os.path.join(target, file))
-                            files_copied.append(os.path.join(target, file))
+                files_copied.extend(_copy_new_files(source, target, now, delay))
             else:
                 print(f"'{source}' does not exist.")
 
@@ -331,6 +331,9 @@ class SFTPClient:
                     # walk local directory structure, put file to remote location
                     for dirpath, dirnames, filenames in os.walk(top=localpath):
                         for filename in filenames:
+                            if filename.endswith(".part"):
+                                # still being written
+                                continue
                             localitem = os.path.join(dirpath, filename)
                             remoteitem = os.path.join(dirpath.replace(localpath, remotepath), filename)
                             remoteitem = re.sub(r'(\\){1,2}', '/', remoteitem)